@@ -2,12 +2,19 @@ import os
 import re
 import random
 import string
-from datetime import datetime
+import time
+import asyncio
+import functools
+import multiprocessing
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
 
 import requests
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
-from pymongo.errors import DuplicateKeyError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from dotenv import load_dotenv
 
 from telegram import (
@@ -24,6 +31,20 @@ from telegram.ext import (
     ContextTypes,
 )
 
+import charts
+from render import (
+    main_menu_keyboard,
+    prices_menu_keyboard,
+    back_to_main_keyboard,
+    back_to_prices_keyboard,
+    support_keyboard,
+    price_keyboard,
+    join_channel_keyboard,
+    chart_keyboard,
+    price_card,
+    warm_up_keyboards,
+)
+
 # ===========================
 # تنظیمات
 # ===========================
@@ -34,22 +55,37 @@ TOKEN = os.getenv("TELEGRAM_TOKEN")
 MONGO_URI = os.getenv("MONGO_URI")
 CHANNEL_ID = os.getenv("CHANNEL_ID")
 NEWS_API_KEY = os.getenv("NEWS_API_KEY")
+CHART_WORKERS = int(os.getenv("CHART_WORKERS", "2"))
+HEAVY_CONCURRENCY = int(os.getenv("HEAVY_CONCURRENCY", "8"))
+STATS_FLUSH_SECONDS = int(os.getenv("STATS_FLUSH_SECONDS", "60"))
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip().isdigit()}
 
 # ===========================
 # اتصال به دیتابیس
 # ===========================
-client = MongoClient(MONGO_URI, server_api=ServerApi("1"))
+# connect=False: اتصال واقعی با اولین درخواست برقرار می‌شود، تا import این فایل
+# (مثلاً در workerهای رندر چارت) به دیتابیس وصل نشود
+client = MongoClient(MONGO_URI, server_api=ServerApi("1"), connect=False)
 db = client["Bot_User"]
 users = db["users"]
 
-users.create_index("user_id", unique=True)
-users.create_index("invite_code", unique=True)
+# آمار تجمیع‌شده: هر سند یک بازه ساعتی (h:...، با TTL) یا روزانه (d:...) است
+stats = db["stats"]
+# کاربران فعال هر روز فقط برای شمارش DAU؛ بعد از چند روز خودکار پاک می‌شوند
+active_users = db["active_users"]
+
+def init_db():
+    users.create_index("user_id", unique=True)
+    users.create_index("invite_code", unique=True)
+    active_users.create_index("created_at", expireAfterSeconds=3 * 24 * 3600)
+    # فقط سندهای ساعتی فیلد expires_at دارند؛ سندهای روزانه نگه داشته می‌شوند
+    stats.create_index("expires_at", expireAfterSeconds=0)
 
-try:
-    client.admin.command("ping")
-    print("✅ Connected to MongoDB Atlas")
-except Exception as e:
-    print("❌ MongoDB Connection Error:", e)
+    try:
+        client.admin.command("ping")
+        print("✅ Connected to MongoDB Atlas")
+    except Exception as e:
+        print("❌ MongoDB Connection Error:", e)
 
 # ===========================
 # ابزارها
@@ -63,9 +99,13 @@ def generate_invite_code() -> str:
     return f"Siglona_{code}"
 
 def upsert_user(user_id: int, username: str) -> dict:
+    return insert_user_if_missing(user_id, username)[0]
+
+def insert_user_if_missing(user_id: int, username: str) -> tuple[dict, bool]:
+    """مثل upsert_user، به همراه اینکه کاربر همین حالا ساخته شده یا نه."""
     doc = users.find_one({"user_id": user_id})
     if doc:
-        return doc
+        return doc, False
     invite_code = generate_invite_code()
     new_doc = {
         "user_id": user_id,
@@ -81,9 +121,9 @@ def upsert_user(user_id: int, username: str) -> dict:
     }
     try:
         users.insert_one(new_doc)
-        return new_doc
+        return new_doc, True
     except DuplicateKeyError:
-        return users.find_one({"user_id": user_id})
+        return users.find_one({"user_id": user_id}), False
 
 async def check_membership(user_id: int, context: ContextTypes.DEFAULT_TYPE) -> bool:
     try:
@@ -92,6 +132,146 @@ async def check_membership(user_id: int, context: ContextTypes.DEFAULT_TYPE) ->
     except Exception:
         return False
 
+# ===========================
+# آمار استفاده (شمارنده‌های زمانی در حافظه + flush دوره‌ای با $inc)
+# ===========================
+HOT_WINDOW_HOURS = 6
+HOURLY_STATS_RETENTION = timedelta(days=7)
+
+# (شناسه سند، نام فیلد) -> مقدار افزایش از آخرین flush
+STATS_BUFFER: Counter = Counter()
+# (روز، user_id) هایی که هنوز در active_users ثبت نشده‌اند
+ACTIVE_BUFFER: set[tuple] = set()
+ACTIVE_SEEN: dict[str, set] = {}
+
+def stats_buckets(now: datetime | None = None) -> tuple[str, str]:
+    now = now or datetime.utcnow()
+    return now.strftime("%Y-%m-%d"), now.strftime("%Y-%m-%dT%H")
+
+def stats_field(name: str) -> str:
+    # نام فیلد در MongoDB نباید نقطه یا $ داشته باشد
+    return name.replace(".", "_").replace("$", "_")
+
+def track_event(event: str, user_id: int | None = None, coin: str | None = None):
+    """ثبت یک رویداد در شمارنده‌های ساعتی و روزانه (فقط در حافظه)."""
+    day, hour = stats_buckets()
+    fields = [f"events.{stats_field(event)}"]
+    if coin:
+        fields.append(f"coins.{stats_field(coin)}")
+    for field in fields:
+        STATS_BUFFER[(f"h:{hour}", field)] += 1
+        STATS_BUFFER[(f"d:{day}", field)] += 1
+
+    if user_id is not None:
+        seen = ACTIVE_SEEN.get(day)
+        if seen is None:
+            # فقط روز جاری را نگه می‌داریم
+            ACTIVE_SEEN.clear()
+            seen = ACTIVE_SEEN[day] = set()
+        if user_id not in seen:
+            seen.add(user_id)
+            ACTIVE_BUFFER.add((day, user_id))
+
+async def hot_coins(limit: int = 10) -> list[str]:
+    """
+    پربازدیدترین ارزهای HOT_WINDOW_HOURS ساعت اخیر، از سندهای ساعتی flush شده
+    به همراه شمارنده‌هایی که هنوز در بافر مانده‌اند.
+    """
+    now = datetime.utcnow()
+    hour_ids = [f"h:{stats_buckets(now - timedelta(hours=i))[1]}" for i in range(HOT_WINDOW_HOURS)]
+    docs = await asyncio.to_thread(lambda: list(stats.find({"_id": {"$in": hour_ids}}, {"coins": 1})))
+
+    total = Counter()
+    for doc in docs:
+        total.update(doc.get("coins", {}))
+    for (doc_id, field), value in STATS_BUFFER.items():
+        if doc_id in hour_ids and field.startswith("coins."):
+            total[field[len("coins."):]] += value
+    return [coin for coin, _ in total.most_common(limit)]
+
+def take_stats_snapshot() -> tuple[Counter, set]:
+    """برداشتن بافرها در thread حلقه رویداد تا نوشتن در دیتابیس بدون قفل انجام شود."""
+    global STATS_BUFFER, ACTIVE_BUFFER
+    snapshot = (STATS_BUFFER, ACTIVE_BUFFER)
+    STATS_BUFFER, ACTIVE_BUFFER = Counter(), set()
+    return snapshot
+
+def restore_stats_snapshot(snapshot: tuple[Counter, set]):
+    counters, active = snapshot
+    STATS_BUFFER.update(counters)
+    ACTIVE_BUFFER.update(active)
+
+def write_active_users(active: set) -> tuple[Counter, bool]:
+    """
+    ثبت کاربران فعال هر روز؛ خروجی: افزایش dau برای کاربرانی که تازه درج شده‌اند
+    و اینکه همه عملیات موفق بوده یا باید دوباره تلاش شود.
+    """
+    ops = []
+    for day, user_id in active:
+        ops.append(UpdateOne(
+            {"_id": f"{day}:{user_id}"},
+            {"$setOnInsert": {"day": day, "created_at": datetime.utcnow()}},
+            upsert=True,
+        ))
+    try:
+        upserted = list(active_users.bulk_write(ops, ordered=False).upserted_ids.values())
+        ok = True
+    except BulkWriteError as e:
+        # بخشی از عملیات انجام شده؛ آنهایی که درج شده‌اند در تلاش بعدی دوباره شمرده نمی‌شوند
+        upserted = [u["_id"] for u in e.details.get("upserted", [])]
+        ok = False
+
+    dau = Counter()
+    for doc_id in upserted:
+        dau[(f"d:{doc_id.split(':', 1)[0]}", "dau")] += 1
+    return dau, ok
+
+def write_stats_counters(counters: Counter) -> Counter:
+    """نوشتن شمارنده‌ها با $inc؛ خروجی: شمارنده‌هایی که نوشته نشده‌اند و باید برگردند."""
+    incs: dict[str, dict] = {}
+    for (doc_id, field), value in counters.items():
+        incs.setdefault(doc_id, {})[field] = value
+
+    doc_ids = list(incs)
+    expires_at = datetime.utcnow() + HOURLY_STATS_RETENTION
+    ops = []
+    for doc_id in doc_ids:
+        on_insert = {"bucket": doc_id[2:]}
+        if doc_id.startswith("h:"):
+            on_insert["expires_at"] = expires_at
+        ops.append(UpdateOne({"_id": doc_id}, {"$inc": incs[doc_id], "$setOnInsert": on_insert}, upsert=True))
+
+    try:
+        stats.bulk_write(ops, ordered=False)
+        return Counter()
+    except BulkWriteError as e:
+        # عملیات موفق دوباره اعمال نمی‌شوند؛ فقط سندهای ناموفق برمی‌گردند
+        failed = {doc_ids[err["index"]] for err in e.details.get("writeErrors", [])}
+        return Counter({key: value for key, value in counters.items() if key[0] in failed})
+
+async def flush_stats():
+    counters, active = take_stats_snapshot()
+    try:
+        if active:
+            # افزایش dau بلافاصله به شمارنده‌ها اضافه می‌شود تا اگر نوشتن آمار شکست خورد،
+            # همراه بقیه شمارنده‌ها به بافر برگردد و از دست نرود
+            dau, ok = await asyncio.to_thread(write_active_users, active)
+            counters.update(dau)
+            if ok:
+                active = set()
+        if counters:
+            counters = await asyncio.to_thread(write_stats_counters, counters)
+    except Exception as e:
+        print("flush_stats error:", e)
+    finally:
+        # هر چیزی که نوشته نشده برای flush بعدی برمی‌گردد
+        restore_stats_snapshot((counters, active))
+
+async def stats_flush_loop():
+    while True:
+        await asyncio.sleep(STATS_FLUSH_SECONDS)
+        await flush_stats()
+
 # ===========================
 # گرفتن لیست ارزها
 # ===========================
@@ -109,17 +289,23 @@ def get_all_coins() -> dict[str, dict]:
         print("Coin list fetch error:", e)
         return {}
 
-ALL_COINS = get_all_coins()
-print(f"✅ Loaded {len(ALL_COINS)} coins from CoinGecko")
+# در main() پر می‌شود
+ALL_COINS: dict[str, dict] = {}
 
 POPULAR_COINS = ["BTC", "ETH", "BNB", "USDT", "USDC", "XRP", "DOGE", "SOL", "TON", "TRX"]
 
-def coingecko_get_price(cg_id: str) -> float | None:
+def coingecko_get_quote(cg_id: str) -> tuple[float, int | None] | None:
+    """قیمت لحظه‌ای به همراه زمان آخرین به‌روزرسانی آن در CoinGecko (ثانیه، یا None اگر نیامده باشد)."""
     url = "https://api.coingecko.com/api/v3/simple/price"
     try:
-        resp = requests.get(url, params={"ids": cg_id, "vs_currencies": "usd"}, timeout=10)
-        data = resp.json()
-        return float(data[cg_id]["usd"])
+        resp = requests.get(
+            url,
+            params={"ids": cg_id, "vs_currencies": "usd", "include_last_updated_at": "true"},
+            timeout=10,
+        )
+        data = resp.json()[cg_id]
+        updated_at = data.get("last_updated_at")
+        return float(data["usd"]), int(updated_at) if updated_at else None
     except Exception:
         return None
 
@@ -281,6 +467,7 @@ def analyze_trend_with_rsi(cg_id: str) -> dict:
             "rsi": rsi,
             "ma10": ma10,
             "ma30": ma30,
+            "last_candle_ts": int(ohlc[-1][0]),
             "error": None
         }
 
@@ -289,59 +476,50 @@ def analyze_trend_with_rsi(cg_id: str) -> dict:
         return {"error": f"خطا در تحلیل: {e}"}
 
 # ===========================
-# دکمه‌ها با طراحی شیشه‌ای و حرفه‌ای
+# چارت قیمت (رندر در process pool + کش تصویر و file_id تلگرام)
 # ===========================
-def join_channel_keyboard() -> InlineKeyboardMarkup:
-    keyboard = [
-        [InlineKeyboardButton("✨ عضویت در کانال ✨", url=f"https://t.me/{CHANNEL_ID.lstrip('@')}")],
-        [InlineKeyboardButton("✅ تأیید عضویت", callback_data="check_again")],
-    ]
-    return InlineKeyboardMarkup(keyboard)
-
-def main_menu_keyboard() -> InlineKeyboardMarkup:
-    keyboard = [
-        [InlineKeyboardButton("💰 قیمت ارزها", callback_data="prices")],
-        [InlineKeyboardButton("🎟️ لینک دعوت", callback_data="invite_link")],
-        [InlineKeyboardButton("🏆 جدول برترین‌ها", callback_data="top_inviters")],
-        [InlineKeyboardButton("📰 اخبار ارزها", callback_data="crypto_news")],
-        [InlineKeyboardButton("👨‍💻 پشتیبانی", callback_data="support")],
-        [InlineKeyboardButton("ℹ️ راهنما", callback_data="help")],
-    ]
-    return InlineKeyboardMarkup(keyboard)
-
-def prices_menu_keyboard() -> InlineKeyboardMarkup:
-    keyboard = [
-        [
-            InlineKeyboardButton("₿ بیت‌کوین", callback_data="PRICE:BTC"),
-            InlineKeyboardButton("🔶 اتریوم", callback_data="PRICE:ETH"),
-        ],
-        [
-            InlineKeyboardButton("💎 بایننس", callback_data="PRICE:BNB"),
-            InlineKeyboardButton("🔥 سولانا", callback_data="PRICE:SOL"),
-        ],
-        [
-            InlineKeyboardButton("🌀 تتر", callback_data="PRICE:USDT"),
-            InlineKeyboardButton("🐕 دوج‌کوین", callback_data="PRICE:DOGE"),
-        ],
-        [
-            InlineKeyboardButton("🔍 جستجوی ارز", callback_data="search_coin"),
-            InlineKeyboardButton("📊 تحلیل بازار", callback_data="market_analysis"),
-        ],
-        [InlineKeyboardButton("🔙 بازگشت به منوی اصلی", callback_data="main_menu")],
-    ]
-    return InlineKeyboardMarkup(keyboard)
-
-def back_to_main_keyboard() -> InlineKeyboardMarkup:
-    keyboard = [
-        [InlineKeyboardButton("🔙 بازگشت به منوی اصلی", callback_data="main_menu")]
-    ]
-    return InlineKeyboardMarkup(keyboard)
-
-def back_to_prices_keyboard() -> InlineKeyboardMarkup:
-    keyboard = [
-        [InlineKeyboardButton("🔙 بازگشت به بخش قیمت‌ها", callback_data="prices")]
-    ]
-    return InlineKeyboardMarkup(keyboard)
+CHART_CACHE_SIZE = 128
+
+# کلید هر دو کش: (cg_id, days, timestamp آخرین کندل)
+CHART_PNG_CACHE: "OrderedDict[tuple, bytes]" = OrderedDict()
+CHART_FILE_IDS: "OrderedDict[tuple, str]" = OrderedDict()
+CHART_RENDERING: dict[tuple, asyncio.Future] = {}
+CHART_POOL: ProcessPoolExecutor | None = None
+
+def cache_put(cache: OrderedDict, key, value, max_size: int = CHART_CACHE_SIZE):
+    """افزودن به کش LRU و حذف قدیمی‌ترین آیتم‌ها در صورت پر شدن."""
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > max_size:
+        cache.popitem(last=False)
+
+async def get_chart_png(key: tuple, symbol: str, days: int, ohlc: list) -> bytes:
+    """
+    گرفتن PNG از کش یا رندر آن در process pool.
+    درخواست‌های هم‌زمان برای یک کلید فقط یک بار رندر می‌شوند.
+    """
+    png = CHART_PNG_CACHE.get(key)
+    if png is not None:
+        CHART_PNG_CACHE.move_to_end(key)
+        return png
+
+    future = CHART_RENDERING.get(key)
+    if future is None:
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(CHART_POOL, charts.render_chart_png, symbol, days, ohlc)
+        CHART_RENDERING[key] = future
+        try:
+            png = await future
+            cache_put(CHART_PNG_CACHE, key, png)
+        finally:
+            CHART_RENDERING.pop(key, None)
+        return png
+    return await future
+
+def start_chart_pool() -> ProcessPoolExecutor:
+    # spawn: workerها از پروسه‌ای که thread دارد (pymongo، asyncio) fork نمی‌شوند.
+    # اسکریپت اصلی در هر worker دوباره import می‌شود، پس کارهای شبکه‌ای باید در main() بمانند.
+    return ProcessPoolExecutor(max_workers=CHART_WORKERS, mp_context=multiprocessing.get_context("spawn"))
 
 # ===========================
 # منوها با طراحی حرفه‌ای
@@ -380,7 +558,7 @@ async def show_prices_menu(update_or_query, context: ContextTypes.DEFAULT_TYPE):
         await update_or_query.edit_message_text(text, parse_mode="Markdown", reply_markup=prices_menu_keyboard())
 
 async def show_top_inviters(update_or_query, context: ContextTypes.DEFAULT_TYPE):
-    top_users = users.find().sort("invites_count", -1).limit(5)
+    top_users = await asyncio.to_thread(lambda: list(users.find().sort("invites_count", -1).limit(5)))
     
     text = "🏆 *برترین دعوت‌کنندگان* 🏆\n\n"
     
@@ -396,14 +574,48 @@ async def show_top_inviters(update_or_query, context: ContextTypes.DEFAULT_TYPE)
     
     text += "\nبرای افزایش رتبه خود، دوستان بیشتری دعوت کنید!"
     
-    keyboard = [[InlineKeyboardButton("🔙 بازگشت به منوی اصلی", callback_data="main_menu")]]
-    markup = InlineKeyboardMarkup(keyboard)
+    markup = back_to_main_keyboard()
     
     if isinstance(update_or_query, Update):
         await update_or_query.message.reply_text(text, parse_mode="Markdown", reply_markup=markup)
     else:
         await update_or_query.edit_message_text(text, parse_mode="Markdown", reply_markup=markup)
 
+async def send_price_chart(query, context: ContextTypes.DEFAULT_TYPE, symbol: str, days: int):
+    coin = ALL_COINS.get(symbol)
+    if not coin:
+        await query.message.reply_text("❌ نماد ارز نامعتبر است.", reply_markup=back_to_prices_keyboard())
+        return
+
+    ohlc = await asyncio.to_thread(fetch_ohlc_cg, coin["id"], days)
+    candles = [c for c in ohlc if len(c) >= 5]
+    if len(candles) < 2:
+        await query.message.reply_text("❌ داده کافی برای رسم چارت وجود ندارد.", reply_markup=back_to_prices_keyboard())
+        return
+
+    key = (coin["id"], days, int(candles[-1][0]))
+    overlays = " / ".join(f"MA{w}" for w in charts.chart_overlays(len(candles)))
+    caption = f"📈 چارت {symbol} - {days} روزه" + (f" ({overlays})" if overlays else "")
+    markup = chart_keyboard(symbol, days)
+
+    # اگر این تصویر قبلاً آپلود شده، فقط file_id را دوباره می‌فرستیم
+    file_id = CHART_FILE_IDS.get(key)
+    if file_id:
+        CHART_FILE_IDS.move_to_end(key)
+        await query.message.reply_photo(photo=file_id, caption=caption, reply_markup=markup)
+        return
+
+    try:
+        png = await get_chart_png(key, symbol, days, candles)
+    except Exception as e:
+        print("render_chart_png error:", e)
+        await query.message.reply_text("❌ خطا در رسم چارت!", reply_markup=back_to_prices_keyboard())
+        return
+
+    message = await query.message.reply_photo(photo=png, caption=caption, reply_markup=markup)
+    if message.photo:
+        cache_put(CHART_FILE_IDS, key, message.photo[-1].file_id)
+
 # ===========================
 # /start
 # ===========================
@@ -411,20 +623,26 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     user_id = user.id
     username = user.username or f"user_{user_id}"
+    track_event("start", user_id)
     
+    doc, created = await asyncio.to_thread(insert_user_if_missing, user_id, username)
+
     # بررسی ارجاع
     if context.args and context.args[0].startswith('ref_'):
         ref_code = context.args[0][4:]
-        referrer = users.find_one({"invite_code": ref_code})
+        referrer = await asyncio.to_thread(users.find_one, {"invite_code": ref_code})
         if referrer and referrer["user_id"] != user_id:
-            users.update_one(
+            await asyncio.to_thread(
+                users.update_one,
                 {"user_id": referrer["user_id"]},
                 {"$inc": {"invites_count": 1}}
             )
+            # فقط دعوت‌هایی که کاربر جدید ساخته‌اند در آمار روزانه شمرده می‌شوند
+            if created:
+                track_event("referral")
     
-    doc = upsert_user(user_id, username)
     is_member = await check_membership(user_id, context)
-    users.update_one({"user_id": user_id}, {"$set": {"is_member": is_member, "updated_at": datetime.utcnow()}})
+    await asyncio.to_thread(users.update_one, {"user_id": user_id}, {"$set": {"is_member": is_member, "updated_at": datetime.utcnow()}})
     
     if not is_member:
         welcome_text = """
@@ -432,22 +650,126 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         برای استفاده از تمامی امکانات ربات، لطفاً در کانال ما عضو شوید و سپس روی دکمه «تأیید عضویت» کلیک کنید.
         """
-        await update.message.reply_text(welcome_text, parse_mode="Markdown", reply_markup=join_channel_keyboard())
+        await update.message.reply_text(welcome_text, parse_mode="Markdown", reply_markup=join_channel_keyboard(CHANNEL_ID))
         return
     
     await show_main_menu(update, context)
 
+# ===========================
+# محدودیت نرخ کلیک‌ها (sliding window برای هر کاربر و هر اکشن)
+# ===========================
+# (تعداد مجاز، طول پنجره به ثانیه)
+RATE_LIMITS = {
+    "PRICE": (5, 30),
+    "CHART": (3, 30),
+    "top_inviters": (3, 30),
+    "crypto_news": (3, 60),
+    "invite_link": (3, 30),
+}
+DEFAULT_RATE_LIMIT = (20, 60)
+RATE_MAX_KEYS = 50000
+
+# اکشن‌هایی که به دیتابیس یا API بیرونی می‌روند
+HEAVY_ACTIONS = {"PRICE", "CHART", "top_inviters", "crypto_news", "invite_link"}
+
+RATE_HITS: "OrderedDict[tuple, deque]" = OrderedDict()
+INFLIGHT_CALLBACKS: set[tuple] = set()
+INFLIGHT_HEAVY_USERS: set[int] = set()
+HEAVY_SLOTS = asyncio.Semaphore(HEAVY_CONCURRENCY)
+
+def callback_action(data: str) -> str:
+    """نام اکشن یک callback؛ برای PRICE:BTC و CHART:BTC:30 فقط پیشوند در نظر گرفته می‌شود."""
+    return data.split(":", 1)[0]
+
+def rate_limit_allow(user_id: int, action: str) -> bool:
+    """
+    شمارنده sliding window: اگر کاربر در پنجره اخیر به سقف رسیده باشد False برمی‌گرداند.
+    طول هر deque حداکثر برابر سقف مجاز است و تعداد کلیدها هم با LRU محدود می‌شود.
+    """
+    limit, window = RATE_LIMITS.get(action, DEFAULT_RATE_LIMIT)
+    now = time.monotonic()
+    key = (user_id, action)
+    hits = RATE_HITS.get(key)
+    if hits is None:
+        hits = deque(maxlen=limit)
+        RATE_HITS[key] = hits
+        while len(RATE_HITS) > RATE_MAX_KEYS:
+            RATE_HITS.popitem(last=False)
+    else:
+        RATE_HITS.move_to_end(key)
+
+    while hits and now - hits[0] >= window:
+        hits.popleft()
+    if len(hits) >= limit:
+        return False
+    hits.append(now)
+    return True
+
+def throttle_callbacks(handler):
+    """
+    محافظ جلوی هندلر دکمه‌ها:
+      - کلیک‌های بیش از حد فقط یک toast ارزان می‌گیرند
+      - کلیک تکراری روی پیامی که هنوز در حال پردازش است نادیده گرفته می‌شود
+      - هر کاربر هم‌زمان فقط یک اکشن سنگین دارد و کل اکشن‌های سنگین با HEAVY_SLOTS محدود است؛
+        اگر ظرفیتی آزاد نباشد کلیک با toast «شلوغ است» رد می‌شود
+      - query.answer() همین‌جا صدا زده می‌شود، پس هندلر نباید دوباره آن را صدا بزند
+    کارهای blocking (requests و pymongo) داخل هندلرها با asyncio.to_thread اجرا می‌شوند،
+    پس HEAVY_SLOTS واقعاً تعداد کارهای سنگین هم‌زمان را محدود می‌کند و حلقه رویداد آزاد می‌ماند.
+    """
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        user_id = query.from_user.id
+        action = callback_action(query.data or "")
+
+        # کلیک‌های تکراری قبل از شمارنده بررسی می‌شوند تا از سهمیه کاربر کم نکنند
+        msg_key = (query.message.chat_id, query.message.message_id) if query.message else None
+        heavy = action in HEAVY_ACTIONS
+        if msg_key in INFLIGHT_CALLBACKS or (heavy and user_id in INFLIGHT_HEAVY_USERS):
+            await query.answer("⏳ درخواست قبلی شما در حال پردازش است...")
+            return
+
+        # وقتی همه ظرفیت سنگین پر است، کلیک را همین‌جا رد می‌کنیم تا در صف نماند و منقضی نشود
+        if heavy and HEAVY_SLOTS.locked():
+            await query.answer("⏳ ربات در حال حاضر شلوغ است، چند لحظه دیگر دوباره امتحان کنید.")
+            return
+
+        if not rate_limit_allow(user_id, action):
+            await query.answer("⏳ تعداد درخواست‌ها زیاد است، لطفاً کمی صبر کنید.")
+            return
+
+        if msg_key:
+            INFLIGHT_CALLBACKS.add(msg_key)
+        if heavy:
+            INFLIGHT_HEAVY_USERS.add(user_id)
+        try:
+            # پاسخ به callback قبل از هر انتظاری، تا کاربر spinner نبیند و query منقضی نشود
+            await query.answer()
+            if heavy:
+                async with HEAVY_SLOTS:
+                    await handler(update, context)
+            else:
+                await handler(update, context)
+        finally:
+            if msg_key:
+                INFLIGHT_CALLBACKS.discard(msg_key)
+            if heavy:
+                INFLIGHT_HEAVY_USERS.discard(user_id)
+
+    return wrapper
+
 # ===========================
 # هندلر دکمه‌ها
 # ===========================
 SEARCH_STATE = {}
 
+@throttle_callbacks
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer()
     user_id = query.from_user.id
-    doc = upsert_user(user_id, query.from_user.username or f"user_{user_id}")
+    doc = await asyncio.to_thread(upsert_user, user_id, query.from_user.username or f"user_{user_id}")
     data = query.data or ""
+    track_event(f"callback.{callback_action(data)}", user_id)
 
     if data == "support":
         support_text = """
@@ -467,24 +789,19 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         📞 برای ارتباط مستقیم روی دکمه زیر کلیک کنید:
         """
 
-        keyboard = [
-            [InlineKeyboardButton("📞 تماس با پشتیبان", url="https://t.me/SIGLONA_TRADER")],
-            [InlineKeyboardButton("🔙 بازگشت به منوی اصلی", callback_data="main_menu")]
-        ]
-        
         await query.edit_message_text(
             support_text, 
             parse_mode="HTML", 
-            reply_markup=InlineKeyboardMarkup(keyboard),
+            reply_markup=support_keyboard(),
             disable_web_page_preview=True
         )
         return
     
     if data == "check_again":
         is_member = await check_membership(user_id, context)
-        users.update_one({"user_id": user_id}, {"$set": {"is_member": is_member, "updated_at": datetime.utcnow()}})
+        await asyncio.to_thread(users.update_one, {"user_id": user_id}, {"$set": {"is_member": is_member, "updated_at": datetime.utcnow()}})
         if not is_member:
-            await query.edit_message_text("❌ هنوز عضو کانال نیستید! لطفاً ابتدا در کانال عضو شوید.", reply_markup=join_channel_keyboard())
+            await query.edit_message_text("❌ هنوز عضو کانال نیستید! لطفاً ابتدا در کانال عضو شوید.", reply_markup=join_channel_keyboard(CHANNEL_ID))
             return
         await show_main_menu(query, context)
         return
@@ -517,10 +834,10 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if data == "invite_link":
-        me = users.find_one({"user_id": user_id})
+        me = await asyncio.to_thread(users.find_one, {"user_id": user_id})
         my_code = me.get("invite_code")
-        me_bot = await context.bot.get_me()
-        bot_username = me_bot.username
+        # نام کاربری ربات در initialize یک بار گرفته و روی context.bot کش شده است
+        bot_username = context.bot.username
         deep_link = f"https://t.me/{bot_username}?start=ref_{my_code}"
         invites_count = me.get("invites_count", 0)
         
@@ -542,7 +859,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if data == "crypto_news":
-        news_items = fetch_crypto_news(limit=5)
+        news_items = await asyncio.to_thread(fetch_crypto_news, 5)
         if not news_items:
             await query.edit_message_text("❌ خطا در دریافت اخبار" , reply_markup=main_menu_keyboard())
             return
@@ -569,7 +886,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         💰 *بخش قیمت‌ها:*
         - مشاهده قیمت لحظه‌ای ارزهای دیجیتال
         - دریافت تحلیل تکنیکال (RSI، میانگین متحرک)
-        - مشاهده چارت قیمت در TradingView
+        - دریافت تصویر چارت قیمت به همراه میانگین‌های متحرک
 
         🎟️ *سیستم دعوت:*
         - دریافت لینک دعوت اختصاصی
@@ -593,81 +910,30 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await query.edit_message_text("❌ نماد ارز نامعتبر است.", reply_markup=prices_menu_keyboard())
             return
         
-        price = coingecko_get_price(cg_id)
-        if not price:
+        quote = await asyncio.to_thread(coingecko_get_quote, cg_id)
+        if not quote:
             await query.edit_message_text("❌ خطا در دریافت قیمت! لطفاً稍后再试.", reply_markup=prices_menu_keyboard())
             return
+        price, price_ts = quote
+        track_event("coin_view", user_id, coin=symbol)
 
         # تحلیل روند با 30 کندل و RSI
-        analysis = analyze_trend_with_rsi(cg_id)
-        
-        # ایجاد متن قیمت با فرمت زیبا
-        price_formatted = f"{price:,.2f}" if price >= 1 else f"{price:.6f}"
-        
-        if analysis.get("error"):
-            analysis_text = f"⚠️ *خطا در تحلیل:* {analysis.get('error')}"
-        else:
-            combined = analysis.get("combined")
-            rsi = analysis.get("rsi")
-            ma10 = analysis.get("ma10")
-            ma30 = analysis.get("ma30")
-
-            rsi_str = f"{rsi:.2f}" if rsi is not None else "نامشخص"
-            ma10_str = f"{ma10:.4f}" if ma10 is not None else "—"
-            ma30_str = f"{ma30:.4f}" if ma30 is not None else "—"
-
-            # تعیین ایموجی بر اساس وضعیت
-            if combined == "صعودی":
-                trend_emoji = "📈"
-            elif combined == "نزولی":
-                trend_emoji = "📉"
-            else:
-                trend_emoji = "➡️"
-
-            # تعیین وضعیت RSI
-            rsi_status = ""
-            if rsi is not None:
-                if rsi > 70:
-                    rsi_status = " (اشباع خرید 🔴)"
-                elif rsi < 30:
-                    rsi_status = " (اشباع فروش 🟢)"
-                else:
-                    rsi_status = " (عادی 🟡)"
-
-            analysis_text = f"""
-            📊 *تحلیل تکنیکال {symbol}*
-
-            • وضعیت: {trend_emoji} *{combined}*
-            • RSI(14): {rsi_str}{rsi_status}
-            • میانگین متحرک 10 روزه: {ma10_str}
-            • میانگین متحرک 30 روزه: {ma30_str}
+        analysis = await asyncio.to_thread(analyze_trend_with_rsi, cg_id)
 
-            💡 *تفسیر تحلیل:*
-            """
-
-            if combined == "صعودی":
-                analysis_text += "روند صعودی است. احتمال افزایش قیمت وجود دارد."
-            elif combined == "نزولی":
-                analysis_text += "روند نزولی است. مراقب کاهش قیمت باشید."
-            else:
-                analysis_text += "روند خنثی است. منتظر سیگنال واضح‌تر بمانید."
-
-        # ایجاد دکمه‌های مربوط به این ارز
-        keyboard = [
-            [InlineKeyboardButton("📈 مشاهده چارت", url=f"https://www.tradingview.com/chart/?symbol={symbol}USDT")],
-            [InlineKeyboardButton("🔄 بروزرسانی قیمت", callback_data=f"PRICE:{symbol}")],
-            [InlineKeyboardButton("🔙 بازگشت به قیمت‌ها", callback_data="prices")],
-        ]
-        
-        text = f"""
-        💎 *قیمت {symbol}*
-
-        💰 قیمت فعلی: *{price_formatted}* دلار
+        # نسخه داده = زمان آخرین قیمت + زمان آخرین کندل؛ تا وقتی CoinGecko داده تازه‌ای
+        # نداده، کارت از کش برمی‌گردد (درخواست‌های API همچنان در هر کلیک انجام می‌شوند)
+        version = (price_ts, analysis.get("last_candle_ts"))
+        text = price_card(symbol, version, price, analysis)
+        await query.edit_message_text(text, parse_mode="Markdown", reply_markup=price_keyboard(symbol))
+        return
 
-        {analysis_text}
-        """
-        
-        await query.edit_message_text(text, parse_mode="Markdown", reply_markup=InlineKeyboardMarkup(keyboard))
+    if data.startswith("CHART:"):
+        parts = data.split(":")
+        symbol = parts[1] if len(parts) > 1 else ""
+        days = int(parts[2]) if len(parts) > 2 and parts[2].isdigit() else 30
+        if days not in charts.CHART_TIMEFRAMES:
+            days = 30
+        await send_price_chart(query, context, symbol, days)
         return
 
     if data == "search_coin":
@@ -684,6 +950,7 @@ async def search_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
         
     query_text = update.message.text.strip().upper()
+    track_event("search", user_id)
     if len(query_text) < 3:
         await update.message.reply_text("❌ لطفاً حداقل 3 حرف وارد کنید.", reply_markup=back_to_prices_keyboard())
         return
@@ -723,16 +990,85 @@ async def search_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     SEARCH_STATE[user_id] = False
 
+# ===========================
+# گزارش ادمین (/stats) از روی آمار تجمیع‌شده
+# ===========================
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+
+    # شمارنده‌های بافر را هم قبل از گزارش می‌نویسیم تا عددها به‌روز باشند
+    await flush_stats()
+
+    today = datetime.utcnow()
+    days = [(today - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(7)]
+    day_ids = [f"d:{day}" for day in days]
+    docs = {d["_id"]: d for d in await asyncio.to_thread(lambda: list(stats.find({"_id": {"$in": day_ids}})))}
+
+    text = "📊 *آمار استفاده ربات*\n\n"
+    text += "📅 *۷ روز اخیر (کاربر فعال / استارت / دعوت / جستجو):*\n"
+    for day in days:
+        doc = docs.get(f"d:{day}", {})
+        events = doc.get("events", {})
+        text += (
+            f"• {day}: {doc.get('dau', 0)} / {events.get('start', 0)} / "
+            f"{events.get('referral', 0)} / {events.get('search', 0)}\n"
+        )
+
+    coins = docs.get(f"d:{days[0]}", {}).get("coins", {})
+    top = sorted(coins.items(), key=lambda kv: kv[1], reverse=True)[:10]
+    hot = await hot_coins(5)
+    text += f"\n🔥 *ارزهای داغ {HOT_WINDOW_HOURS} ساعت اخیر:* "
+    text += (", ".join(f"`{sym}`" for sym in hot) if hot else "—") + "\n"
+
+    text += "\n💰 *پربازدیدترین ارزهای امروز:*\n"
+    if top:
+        for sym, count in top:
+            text += f"• `{sym}`: {count}\n"
+    else:
+        text += "• هنوز بازدیدی ثبت نشده\n"
+
+    await update.message.reply_text(text, parse_mode="Markdown")
+
+async def post_init(app: Application):
+    app.bot_data["stats_task"] = asyncio.create_task(stats_flush_loop())
+
+async def post_shutdown(app: Application):
+    task = app.bot_data.get("stats_task")
+    if task:
+        task.cancel()
+    await flush_stats()
+
 # ===========================
 # اجرا
 # ===========================
 def main():
-    app = Application.builder().token(TOKEN).build()
+    global CHART_POOL
+    init_db()
+    ALL_COINS.update(get_all_coins())
+    print(f"✅ Loaded {len(ALL_COINS)} coins from CoinGecko")
+    CHART_POOL = start_chart_pool()
+    # منوهای ثابت قبل از اولین کلیک ساخته می‌شوند
+    warm_up_keyboards()
+    join_channel_keyboard(CHANNEL_ID)
+    # پردازش هم‌زمان آپدیت‌ها تا کلیک‌های تکراری در throttle_callbacks جمع شوند
+    app = (
+        Application.builder()
+        .token(TOKEN)
+        .concurrent_updates(True)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("stats", stats_command))
     app.add_handler(CallbackQueryHandler(button_handler))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, search_handler))
     print("🤖 Bot running")
-    app.run_polling()
+    try:
+        app.run_polling()
+    finally:
+        CHART_POOL.shutdown(cancel_futures=True)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
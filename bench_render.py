@@ -0,0 +1,84 @@
+"""
+میکروبنچمارک لایه رندر: زمان CPU ساخت منوها و کارت قیمت در هر callback.
+
+- منوها: همیشه از کش برمی‌گردند، پس صرفه‌جویی در هر کلیکی اعمال می‌شود.
+- کارت قیمت: فقط وقتی نسخه داده (زمان آخرین قیمت و آخرین کندل) تکرار شود از کش می‌آید؛
+  با داده تازه (cache miss) هزینه همان رندر کامل است.
+این اعداد فقط هزینه CPU رندر را نشان می‌دهند؛ درخواست‌های CoinGecko در هر کلیک PRICE
+همچنان انجام می‌شوند و در این بنچمارک نیستند.
+
+اجرا:
+    python bench_render.py
+"""
+import itertools
+import timeit
+
+from render import (
+    main_menu_keyboard,
+    prices_menu_keyboard,
+    back_to_main_keyboard,
+    price_keyboard,
+    price_card,
+    build_price_card,
+    warm_up_keyboards,
+)
+
+ANALYSIS = {
+    "combined": "صعودی",
+    "overall_trend": "صعودی",
+    "rsi": 61.234,
+    "ma10": 64210.1234,
+    "ma30": 62877.5678,
+    "last_candle_ts": 1760832000000,
+    "error": None,
+}
+PRICE = 65123.45
+PRICE_TS = 1760860000
+
+def keyboards_uncached():
+    # هر بار منوها از نو ساخته می‌شوند (رفتار قبلی)
+    main_menu_keyboard.__wrapped__()
+    prices_menu_keyboard.__wrapped__()
+    back_to_main_keyboard.__wrapped__()
+    price_keyboard.__wrapped__("BTC")
+
+def keyboards_cached():
+    main_menu_keyboard()
+    prices_menu_keyboard()
+    back_to_main_keyboard()
+    price_keyboard("BTC")
+
+def card_uncached():
+    build_price_card("BTC", PRICE, ANALYSIS)
+
+def card_hit():
+    # نسخه داده تغییر نکرده (مثلاً چند کلیک «بروزرسانی» در همان دقیقه)
+    price_card("BTC", (PRICE_TS, ANALYSIS["last_candle_ts"]), PRICE, ANALYSIS)
+
+_versions = itertools.count(PRICE_TS)
+
+def card_miss():
+    # هر فراخوانی نسخه تازه‌ای دارد، پس همیشه رندر کامل + درج در کش
+    price_card("BTC", (next(_versions), ANALYSIS["last_candle_ts"]), PRICE, ANALYSIS)
+
+def bench(func, number: int = 20000) -> float:
+    best = min(timeit.repeat(func, number=number, repeat=5))
+    return best / number * 1e6
+
+def main():
+    warm_up_keyboards()
+    price_keyboard("BTC")
+    card_hit()
+
+    rows = [
+        ("keyboards, uncached", bench(keyboards_uncached)),
+        ("keyboards, cached", bench(keyboards_cached)),
+        ("price card, uncached", bench(card_uncached)),
+        ("price card, cache miss (new data)", bench(card_miss)),
+        ("price card, cache hit (same data)", bench(card_hit)),
+    ]
+    for name, us in rows:
+        print(f"{name:36s} {us:8.2f} us")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import io
+from datetime import datetime
+
+# ===========================
+# رسم چارت قیمت
+# ===========================
+# این ماژول در workerهای process pool (با روش spawn) import می‌شود،
+# پس نباید هنگام import به دیتابیس یا API بیرونی وصل شود.
+
+# CoinGecko برای 1 تا 30 روز کندل 4 ساعته می‌دهد؛ برای بازه‌های بلندتر کندل 4 روزه
+# (حدود 23 نقطه برای 90 روز) که برای MA30 کافی نیست، پس فقط همین بازه‌ها را داریم.
+CHART_TIMEFRAMES = (7, 30)
+# پنجره میانگین‌های متحرک و رنگ هر کدام
+MA_OVERLAYS = ((10, "#f5c542"), (30, "#42a5f5"))
+
+def chart_overlays(candle_count: int) -> list[int]:
+    """میانگین‌هایی که با این تعداد کندل قابل رسم‌اند (بقیه از چارت و legend حذف می‌شوند)."""
+    return [window for window, _ in MA_OVERLAYS if candle_count >= window]
+
+def sma_series(values: list[float], window: int) -> list[float]:
+    """سری کامل SMA؛ برای نقاطی که داده کافی ندارند NaN برمی‌گرداند."""
+    result = []
+    running = 0.0
+    for i, v in enumerate(values):
+        running += v
+        if i >= window:
+            running -= values[i - window]
+        result.append(running / window if i >= window - 1 else float("nan"))
+    return result
+
+def render_chart_png(symbol: str, days: int, ohlc: list) -> bytes:
+    """
+    رسم چارت کندلی به همراه MA10 و MA30 و خروجی PNG.
+    این تابع در process pool اجرا می‌شود، پس فقط داده ساده می‌گیرد و به state ربات دست نمی‌زند.
+    """
+    # از Figure مستقیم استفاده می‌کنیم (بدون pyplot) تا به backend گرافیکی وابسته نباشد
+    from matplotlib.figure import Figure
+
+    xs = list(range(len(ohlc)))
+    opens = [c[1] for c in ohlc]
+    highs = [c[2] for c in ohlc]
+    lows = [c[3] for c in ohlc]
+    closes = [c[4] for c in ohlc]
+    colors = ["#26a69a" if c >= o else "#ef5350" for o, c in zip(opens, closes)]
+
+    fig = Figure(figsize=(8, 4.5), dpi=100, facecolor="#131722")
+    ax = fig.add_subplot(1, 1, 1)
+    ax.set_facecolor("#131722")
+
+    # سایه‌ها و بدنه کندل‌ها
+    ax.vlines(xs, lows, highs, colors=colors, linewidth=1)
+    price_range = (max(highs) - min(lows)) or 1.0
+    bodies = [max(abs(c - o), price_range * 0.002) for o, c in zip(opens, closes)]
+    ax.bar(xs, bodies, bottom=[min(o, c) for o, c in zip(opens, closes)], width=0.6, color=colors)
+
+    windows = chart_overlays(len(closes))
+    for window, color in MA_OVERLAYS:
+        if window in windows:
+            ax.plot(xs, sma_series(closes, window), color=color, linewidth=1.2, label=f"MA{window}")
+
+    step = max(1, len(xs) // 6)
+    ticks = xs[::step]
+    ax.set_xticks(ticks)
+    ax.set_xticklabels([datetime.utcfromtimestamp(ohlc[i][0] / 1000).strftime("%m-%d") for i in ticks])
+
+    ax.set_title(f"{symbol}/USD - {days}D", color="white")
+    ax.tick_params(colors="#b2b5be")
+    ax.grid(color="#2a2e39", linewidth=0.5)
+    for spine in ax.spines.values():
+        spine.set_color("#2a2e39")
+    if windows:
+        ax.legend(loc="upper left", facecolor="#131722", edgecolor="#2a2e39", labelcolor="white")
+    fig.tight_layout()
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", facecolor=fig.get_facecolor())
+    return buf.getvalue()
@@ -0,0 +1,193 @@
+import functools
+from collections import OrderedDict
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from charts import CHART_TIMEFRAMES
+
+# ===========================
+# لایه رندر: منوهای ثابت و کارت قیمت
+# ===========================
+# آبجکت‌های InlineKeyboardMarkup در python-telegram-bot تغییرناپذیرند،
+# پس منوهای ثابت یک بار (در warm_up_keyboards هنگام شروع ربات) ساخته می‌شوند
+# و در هر callback همان آبجکت برگردانده می‌شود.
+
+@functools.cache
+def join_channel_keyboard(channel_id: str) -> InlineKeyboardMarkup:
+    keyboard = [
+        [InlineKeyboardButton("✨ عضویت در کانال ✨", url=f"https://t.me/{channel_id.lstrip('@')}")],
+        [InlineKeyboardButton("✅ تأیید عضویت", callback_data="check_again")],
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+@functools.cache
+def main_menu_keyboard() -> InlineKeyboardMarkup:
+    keyboard = [
+        [InlineKeyboardButton("💰 قیمت ارزها", callback_data="prices")],
+        [InlineKeyboardButton("🎟️ لینک دعوت", callback_data="invite_link")],
+        [InlineKeyboardButton("🏆 جدول برترین‌ها", callback_data="top_inviters")],
+        [InlineKeyboardButton("📰 اخبار ارزها", callback_data="crypto_news")],
+        [InlineKeyboardButton("👨‍💻 پشتیبانی", callback_data="support")],
+        [InlineKeyboardButton("ℹ️ راهنما", callback_data="help")],
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+@functools.cache
+def prices_menu_keyboard() -> InlineKeyboardMarkup:
+    keyboard = [
+        [
+            InlineKeyboardButton("₿ بیت‌کوین", callback_data="PRICE:BTC"),
+            InlineKeyboardButton("🔶 اتریوم", callback_data="PRICE:ETH"),
+        ],
+        [
+            InlineKeyboardButton("💎 بایننس", callback_data="PRICE:BNB"),
+            InlineKeyboardButton("🔥 سولانا", callback_data="PRICE:SOL"),
+        ],
+        [
+            InlineKeyboardButton("🌀 تتر", callback_data="PRICE:USDT"),
+            InlineKeyboardButton("🐕 دوج‌کوین", callback_data="PRICE:DOGE"),
+        ],
+        [
+            InlineKeyboardButton("🔍 جستجوی ارز", callback_data="search_coin"),
+            InlineKeyboardButton("📊 تحلیل بازار", callback_data="market_analysis"),
+        ],
+        [InlineKeyboardButton("🔙 بازگشت به منوی اصلی", callback_data="main_menu")],
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+@functools.cache
+def back_to_main_keyboard() -> InlineKeyboardMarkup:
+    keyboard = [
+        [InlineKeyboardButton("🔙 بازگشت به منوی اصلی", callback_data="main_menu")]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+@functools.cache
+def back_to_prices_keyboard() -> InlineKeyboardMarkup:
+    keyboard = [
+        [InlineKeyboardButton("🔙 بازگشت به بخش قیمت‌ها", callback_data="prices")]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+@functools.cache
+def support_keyboard() -> InlineKeyboardMarkup:
+    keyboard = [
+        [InlineKeyboardButton("📞 تماس با پشتیبان", url="https://t.me/SIGLONA_TRADER")],
+        [InlineKeyboardButton("🔙 بازگشت به منوی اصلی", callback_data="main_menu")]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+@functools.lru_cache(maxsize=1024)
+def price_keyboard(symbol: str) -> InlineKeyboardMarkup:
+    keyboard = [
+        [InlineKeyboardButton("📈 مشاهده چارت", callback_data=f"CHART:{symbol}:30")],
+        [InlineKeyboardButton("🔄 بروزرسانی قیمت", callback_data=f"PRICE:{symbol}")],
+        [InlineKeyboardButton("🔙 بازگشت به قیمت‌ها", callback_data="prices")],
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+@functools.lru_cache(maxsize=1024)
+def chart_keyboard(symbol: str, days: int) -> InlineKeyboardMarkup:
+    keyboard = [
+        [
+            InlineKeyboardButton(f"{'✅ ' if d == days else ''}{d} روزه", callback_data=f"CHART:{symbol}:{d}")
+            for d in CHART_TIMEFRAMES
+        ],
+        [InlineKeyboardButton(f"💎 قیمت {symbol}", callback_data=f"PRICE:{symbol}")],
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+def warm_up_keyboards():
+    """ساخت منوهای ثابت هنگام شروع ربات، تا اولین کلیک هم هزینه ساخت نداشته باشد."""
+    main_menu_keyboard()
+    prices_menu_keyboard()
+    back_to_main_keyboard()
+    back_to_prices_keyboard()
+    support_keyboard()
+
+# ===========================
+# کارت قیمت (memoize بر اساس نسخه داده)
+# ===========================
+PRICE_CARD_CACHE_SIZE = 1024
+PRICE_CARD_CACHE: "OrderedDict[tuple, str]" = OrderedDict()
+
+def price_card(symbol: str, version: tuple, price: float, analysis: dict) -> str:
+    """
+    کارت قیمت از کش، بر اساس نسخه داده (مثلاً زمان آخرین قیمت و آخرین کندل).
+    تا وقتی نسخه عوض نشده، رندر فقط یک جستجوی دیکشنری است.
+    """
+    if analysis.get("error") or not all(version):
+        # پیام خطا به نسخه داده وابسته نیست، و بدون timestamp کامل نسخه معنایی ندارد؛
+        # در این حالت کش نمی‌کنیم تا قیمت قدیمی نمایش داده نشود
+        return build_price_card(symbol, price, analysis)
+
+    key = (symbol, version)
+    text = PRICE_CARD_CACHE.get(key)
+    if text is None:
+        text = build_price_card(symbol, price, analysis)
+        PRICE_CARD_CACHE[key] = text
+        while len(PRICE_CARD_CACHE) > PRICE_CARD_CACHE_SIZE:
+            PRICE_CARD_CACHE.popitem(last=False)
+    return text
+
+def build_price_card(symbol: str, price: float, analysis: dict) -> str:
+    """ساخت متن کارت قیمت یک ارز (بدون کش)."""
+    error = analysis.get("error")
+    combined = analysis.get("combined")
+    rsi = analysis.get("rsi")
+    ma10 = analysis.get("ma10")
+    ma30 = analysis.get("ma30")
+
+    # ایجاد متن قیمت با فرمت زیبا
+    price_formatted = f"{price:,.2f}" if price >= 1 else f"{price:.6f}"
+
+    if error:
+        analysis_text = f"⚠️ *خطا در تحلیل:* {error}"
+    else:
+        rsi_str = f"{rsi:.2f}" if rsi is not None else "نامشخص"
+        ma10_str = f"{ma10:.4f}" if ma10 is not None else "—"
+        ma30_str = f"{ma30:.4f}" if ma30 is not None else "—"
+
+        # تعیین ایموجی بر اساس وضعیت
+        if combined == "صعودی":
+            trend_emoji = "📈"
+        elif combined == "نزولی":
+            trend_emoji = "📉"
+        else:
+            trend_emoji = "➡️"
+
+        # تعیین وضعیت RSI
+        rsi_status = ""
+        if rsi is not None:
+            if rsi > 70:
+                rsi_status = " (اشباع خرید 🔴)"
+            elif rsi < 30:
+                rsi_status = " (اشباع فروش 🟢)"
+            else:
+                rsi_status = " (عادی 🟡)"
+
+        analysis_text = f"""
+            📊 *تحلیل تکنیکال {symbol}*
+
+            • وضعیت: {trend_emoji} *{combined}*
+            • RSI(14): {rsi_str}{rsi_status}
+            • میانگین متحرک 10 روزه: {ma10_str}
+            • میانگین متحرک 30 روزه: {ma30_str}
+
+            💡 *تفسیر تحلیل:*
+            """
+
+        if combined == "صعودی":
+            analysis_text += "روند صعودی است. احتمال افزایش قیمت وجود دارد."
+        elif combined == "نزولی":
+            analysis_text += "روند نزولی است. مراقب کاهش قیمت باشید."
+        else:
+            analysis_text += "روند خنثی است. منتظر سیگنال واضح‌تر بمانید."
+
+    return f"""
+        💎 *قیمت {symbol}*
+
+        💰 قیمت فعلی: *{price_formatted}* دلار
+
+        {analysis_text}
+        """